@@ -4,7 +4,20 @@
 """
 import json
 import os
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional, List, Tuple
+
+# 可选依赖：orjson 解析更快，未安装时回退到标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 剧情缓存条数上限，超出后淘汰最久未使用的条目
+MAX_CACHED_PLOTS = 256
+
+# 已解析剧情文件索引的条数上限，超出后淘汰最久未使用的文件
+MAX_CACHED_FILES = 64
 
 
 class PlotManager:
@@ -12,13 +25,17 @@ class PlotManager:
     
     def __init__(self, plots_dir: str = "plots"):
         self.plots_dir = plots_dir
-        self.plot_cache = {}
+        self._plots_dir = os.fspath(plots_dir)
+        self.plot_cache = OrderedDict()  # 按最近使用排序
+        self.on_plot_evicted: Optional[Callable[[str], None]] = None  # 剧情缓存被淘汰时的回调
+        self._file_index: "OrderedDict[str, Dict[Tuple[str, int], Dict[str, Any]]]" = OrderedDict()  # 按最近使用排序
+        # 预先拼好路径前缀，避免每次加载都调用 os.path.join
+        self._plot_path_prefix = os.path.join(self._plots_dir, "plot_")
         self._ensure_plots_dir()
     
     def _ensure_plots_dir(self):
         """确保剧情目录存在"""
-        if not os.path.exists(self.plots_dir):
-            os.makedirs(self.plots_dir)
+        os.makedirs(self._plots_dir, exist_ok=True)
     
     def load_plot(self, scene: str, level: int = 1) -> Optional[Dict[str, Any]]:
         """加载指定场景的剧情"""
@@ -26,30 +43,58 @@ class PlotManager:
         
         # 检查缓存
         if cache_key in self.plot_cache:
+            self.plot_cache.move_to_end(cache_key)
             return self.plot_cache[cache_key]
         
         # 尝试加载文件
-        plot_file = os.path.join(self.plots_dir, f"plot_{scene}.json")
+        plot_file = f"{self._plot_path_prefix}{scene}.json"
         
-        if not os.path.exists(plot_file):
-            return None
+        index = self._file_index.get(plot_file)
+        if index is None:
+            index = self._load_plot_index(plot_file)
+            if index is None:
+                return None
+            self._file_index[plot_file] = index
+            while len(self._file_index) > MAX_CACHED_FILES:
+                self._file_index.popitem(last=False)
+            
+            for (item_scene, item_level), plot_item in index.items():
+                if item_scene == scene:
+                    self._cache_plot(f"{scene}_level{item_level}", plot_item)
+        else:
+            self._file_index.move_to_end(plot_file)
         
+        return index.get((scene, level))
+    
+    def _cache_plot(self, cache_key: str, plot_item: Dict[str, Any]):
+        """写入剧情缓存，超出上限时淘汰最久未使用的条目"""
+        self.plot_cache[cache_key] = plot_item
+        self.plot_cache.move_to_end(cache_key)
+        while len(self.plot_cache) > MAX_CACHED_PLOTS:
+            evicted_key, _ = self.plot_cache.popitem(last=False)
+            if self.on_plot_evicted:
+                self.on_plot_evicted(evicted_key)
+    
+    def _load_plot_index(self, plot_file: str) -> Optional[Dict[Tuple[str, int], Dict[str, Any]]]:
+        """加载剧情文件的 (scene, level) 索引"""
+        # 直接打开，文件不存在时由异常返回，省去单独的存在性检查
         try:
-            with open(plot_file, "r", encoding="utf-8") as f:
-                plot_data = json.load(f)
-            
-            # 查找匹配的场景和等级
-            for plot_item in plot_data:
-                if (plot_item.get("scene") == scene and 
-                    plot_item.get("level", 1) == level):
-                    self.plot_cache[cache_key] = plot_item
-                    return plot_item
-            
+            with open(plot_file, "rb") as f:
+                raw = f.read()
+            plot_data = orjson.loads(raw) if orjson else json.loads(raw)
+        except FileNotFoundError:
             return None
-            
+        # orjson.JSONDecodeError 是 json.JSONDecodeError 的子类
         except (json.JSONDecodeError, IOError) as e:
             print(f"加载剧情文件失败 {plot_file}: {e}")
             return None
+        
+        # 一次性为文件内所有剧情建立 (scene, level) 索引，同键保留首个
+        index = {}
+        for plot_item in plot_data:
+            index.setdefault((plot_item.get("scene"), plot_item.get("level", 1)), plot_item)
+        
+        return index
     
     def get_plot_text(self, scene: str, level: int = 1) -> str:
         """获取剧情文本"""
@@ -69,13 +114,17 @@ class PlotManager:
         """获取所有可用的场景"""
         scenes = []
         
-        if not os.path.exists(self.plots_dir):
-            return scenes
-        
-        for filename in os.listdir(self.plots_dir):
-            if filename.startswith("plot_") and filename.endswith(".json"):
-                scene_name = filename[5:-5]  # 移除 "plot_" 前缀和 ".json" 后缀
-                scenes.append(scene_name)
+        # scandir 自带目录项类型信息，判断是否为文件无需额外 stat
+        try:
+            with os.scandir(self._plots_dir) as it:
+                for entry in it:
+                    name = entry.name
+                    if (name.startswith("plot_") and name.endswith(".json") and
+                            entry.is_file(follow_symlinks=False)):
+                        scene_name = name[5:-5]  # 移除 "plot_" 前缀和 ".json" 后缀
+                        scenes.append(scene_name)
+        except FileNotFoundError:
+            pass
         
         return scenes
     
@@ -84,11 +133,13 @@ class PlotManager:
         cache_key = f"{scene}_level{level}"
         if cache_key in self.plot_cache:
             del self.plot_cache[cache_key]
+        self._file_index.pop(f"{self._plot_path_prefix}{scene}.json", None)
         return self.load_plot(scene, level)
     
     def clear_cache(self):
         """清空所有剧情缓存"""
         self.plot_cache.clear()
+        self._file_index.clear()
     
     def get_cache_info(self) -> Dict[str, Any]:
         """获取缓存信息"""
@@ -3,70 +3,86 @@ AI 服务模块
 基于原有 service.py 的 AI 交互逻辑，适配新的架构
 """
 import json
+import re
 import asyncio
-from typing import Dict, Any, List, Optional
-from openai import OpenAI, OpenAIError
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Callable, Deque, Dict, Any, Optional, Tuple
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAIError
 from service_config import ConfigService
+from service_character import Character
 
+# 可选依赖：orjson 解析更快，未安装时回退到标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class AIService:
-    """AI 服务类"""
-    
-    def __init__(self):
-        self.config_service = ConfigService()
-        self.client = None
-        self.session_histories = {}  # 存储会话历史
-        self._initialize_client()
-    
-    def _initialize_client(self):
-        """初始化 AI 客户端"""
-        ai_config = self.config_service.get_ai_config()
-        
-        try:
-            client_args = {"api_key": ai_config['api_key']}
-            if ai_config.get('base_url'):
-                client_args["base_url"] = ai_config['base_url']
-            
-            self.client = OpenAI(**client_args)
-            
-            if self.config_service.is_debug_mode():
-                print(f"AI client initialized successfully")
-                print(f"   Provider: {ai_config['provider']}")
-                print(f"   Model: {ai_config['model']}")
-                if ai_config.get('base_url'):
-                    print(f"   Endpoint: {ai_config['base_url']}")
-                    
-        except Exception as e:
-            print(f"AI client initialization failed: {e}")
-            self.client = None
-    
-    def _get_session_history(self, session_id: str) -> List[Dict]:
-        """获取会话历史"""
-        if session_id not in self.session_histories:
-            self.session_histories[session_id] = []
-        return self.session_histories[session_id]
-    
-    def _clear_session_history(self, session_id: str):
-        """清空会话历史"""
-        self.session_histories[session_id] = []
-    
-    def build_character_prompt(self, character_name: str, character_personality: str, 
-                             current_location: str, mood: float) -> str:
-        """构建角色系统提示词"""
-        mood_level = "优秀" if mood >= 0.7 else "良好" if mood >= 0.4 else "差"
-        
-        prompt = f"""你现在扮演游戏角色【{character_name}】，当前心情值={mood:.2f}（{mood_level}）。
 
-角色设定: {character_personality}
+# 单次请求超时（秒）和失败重试次数
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 2
+
+# 客户端缓存，按 (api_key, base_url, 事件循环) 复用连接池，避免重复 TCP/TLS 握手。
+# 异步连接池只能在创建它的事件循环中使用，所以每个事件循环各有一组客户端
+_CLIENT_CACHE: Dict[Tuple[str, Optional[str], asyncio.AbstractEventLoop], AsyncOpenAI] = {}
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """获取（或创建）当前事件循环共享的异步 OpenAI 客户端，须在协程中调用"""
+    cache_key = (api_key, base_url, asyncio.get_running_loop())
+    client = _CLIENT_CACHE.get(cache_key)
+    if client is None:
+        client_args = {"api_key": api_key}
+        if base_url:
+            client_args["base_url"] = base_url
+        client = AsyncOpenAI(
+            **client_args,
+            timeout=REQUEST_TIMEOUT,
+            max_retries=MAX_RETRIES,
+            # 使用 SDK 的默认 httpx 客户端配置（超时、重定向等），只调整连接池大小
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+            )
+        )
+        _CLIENT_CACHE[cache_key] = client
+    return client
+
+
+async def close_openai_clients():
+    """关闭当前事件循环创建的所有客户端，事件循环关闭前调用"""
+    loop = asyncio.get_running_loop()
+    for cache_key in [key for key in _CLIENT_CACHE if key[2] is loop]:
+        await _CLIENT_CACHE.pop(cache_key).close()
+
+
+# 匹配 AI 回复外层的 markdown 代码块标记（```json ... ```）
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+# 同时保留的会话数上限，超出后淘汰最久未使用的会话
+MAX_SESSIONS = 1024
+
+# 每个会话保留的非系统消息条数（最近 9 轮对话，用户与回复成对写入）
+_MAX_HISTORY_MESSAGES = 18
 
-当前位置: {current_location}
+# 心情等级查找表，下标为 int(mood * 10)：<0.4 差，<0.7 良好，其余优秀
+_MOOD_LEVELS = ("差",) * 4 + ("良好",) * 3 + ("优秀",) * 4
+
+# 角色系统提示词分为三段：随心情变化的开头、角色固定的设定段和规则段，
+# 当前位置夹在设定段与规则段之间
+_PROMPT_HEADER = "你现在扮演游戏角色【{name}】，当前心情值={mood:.2f}（{mood_level}）。\n\n"
+
+_PROMPT_PREFIX = "角色设定: {personality}\n\n当前位置: "
+
+_PROMPT_SUFFIX = """
 
 你需要:
-- 始终保持角色身份，以{character_name}的身份回应
+- 始终保持角色身份，以{name}的身份回应
 - 根据心情值调整语气：越接近 0 语气越差，越接近 1 越友善
 - 保持对话的趣味性和吸引力
 - 在适当的时候帮助玩家
-- 回复保持在 {self.config_service.get_max_response_length()} 字符以内
+- 回复保持在 {max_len} 字符以内
 - 使用中文回复
 - 只讨论与当前游戏场景、剧情相关的内容
 - 如果玩家提出与游戏无关的问题，请礼貌地引导回游戏内容
@@ -78,14 +94,91 @@ class AIService:
 }}
 
 重要：绝不透露你是 AI 或任何技术细节，始终保持角色扮演。"""
+
+
+class AIService:
+    """AI 服务类"""
+    
+    def __init__(self):
+        self.config_service = ConfigService()
+        self.session_histories = OrderedDict()  # 存储会话历史（不含系统消息），按最近使用排序
+        self._system_prompts = {}  # 会话当前的系统消息
+        self._prompt_fingerprints = {}  # 会话当前系统提示词的指纹
+        self.on_session_evicted: Optional[Callable[[str], None]] = None  # 会话被淘汰时的回调
+        self._initialize_client()
+    
+    def _initialize_client(self):
+        """输出 AI 客户端配置（客户端在首次请求时按事件循环创建）"""
+        if self.config_service.is_debug_mode():
+            ai_config = self.config_service.get_ai_config()
+            print("AI client configured")
+            print(f"   Provider: {ai_config['provider']}")
+            print(f"   Model: {ai_config['model']}")
+            if ai_config.get('base_url'):
+                print(f"   Endpoint: {ai_config['base_url']}")
+    
+    def _get_client(self) -> Optional[AsyncOpenAI]:
+        """获取当前事件循环的 AI 客户端，创建失败时返回 None"""
+        ai_config = self.config_service.get_ai_config()
+        try:
+            return get_openai_client(ai_config['api_key'], ai_config.get('base_url'))
+        except Exception as e:
+            print(f"AI client initialization failed: {e}")
+            return None
+    
+    def _get_session_history(self, session_id: str) -> Deque[Dict]:
+        """获取会话历史"""
+        history = self.session_histories.get(session_id)
+        if history is not None:
+            self.session_histories.move_to_end(session_id)
+            return history
         
-        return prompt
+        history = deque(maxlen=_MAX_HISTORY_MESSAGES)
+        self.session_histories[session_id] = history
+        while len(self.session_histories) > MAX_SESSIONS:
+            evicted_id, _ = self.session_histories.popitem(last=False)
+            self._drop_session_state(evicted_id)
+            if self.on_session_evicted:
+                self.on_session_evicted(evicted_id)
+        return history
+    
+    def _drop_session_state(self, session_id: str):
+        """移除会话的系统消息缓存"""
+        self._system_prompts.pop(session_id, None)
+        self._prompt_fingerprints.pop(session_id, None)
+    
+    def _clear_session_history(self, session_id: str):
+        """清空会话历史"""
+        self.session_histories.pop(session_id, None)
+        self._drop_session_state(session_id)
     
-    async def get_character_response(self, character_name: str, character_personality: str,
-                                   player_message: str, current_location: str, 
-                                   mood: float, session_id: str = "default") -> Dict[str, Any]:
+    def prepare_character_prompt(self, character: Character) -> Tuple[int, str, str]:
+        """预先生成角色提示词中与心情、位置无关的部分并保存在角色上"""
+        max_len = self.config_service.get_max_response_length()
+        parts = character._static_prompt_parts
+        if parts is None or parts[0] != max_len:
+            parts = (
+                max_len,
+                _PROMPT_PREFIX.format(personality=character.personality),
+                _PROMPT_SUFFIX.format(name=character.name, max_len=max_len),
+            )
+            character._static_prompt_parts = parts
+        return parts
+    
+    def build_character_prompt(self, character: Character, current_location: str, mood: float) -> str:
+        """构建角色系统提示词"""
+        _, prefix, suffix = self.prepare_character_prompt(character)
+        mood_level = _MOOD_LEVELS[max(0, min(10, int(mood * 10)))]
+        header = _PROMPT_HEADER.format(name=character.name, mood=mood, mood_level=mood_level)
+        return header + prefix + current_location + suffix
+    
+    async def get_character_response(self, character: Character, player_message: str,
+                                   current_location: str, mood: float,
+                                   session_id: str = "default") -> Dict[str, Any]:
         """获取AI角色回复"""
-        if not self.client:
+        character_name = character.name
+        client = self._get_client()
+        if not client:
             return {
                 "msg": f"{character_name}看起来在思考什么，TA 似乎不想和你说话。",
                 "mood": mood,
@@ -94,32 +187,34 @@ class AIService:
             }
         
         try:
-            # 构建系统提示词
-            system_prompt = self.build_character_prompt(
-                character_name, character_personality, current_location, mood
-            )
-            
             # 获取会话历史
             history = self._get_session_history(session_id)
             
-            # 更新或添加系统消息
-            if not history or history[0].get("role") != "system":
-                history.insert(0, {"role": "system", "content": system_prompt})
-            else:
-                history[0]["content"] = system_prompt
+            # 角色、位置、回复长度上限、提示词中渲染的心情值和档位都未变化时沿用已有的系统消息
+            fingerprint = (character.character_id, current_location,
+                           self.config_service.get_max_response_length(),
+                           f"{mood:.2f}", int(mood * 10))
+            system_message = self._system_prompts.get(session_id)
+            if system_message is None or fingerprint != self._prompt_fingerprints.get(session_id):
+                # 构建系统提示词
+                system_prompt = self.build_character_prompt(character, current_location, mood)
+                system_message = {"role": "system", "content": system_prompt}
+                self._system_prompts[session_id] = system_message
+                self._prompt_fingerprints[session_id] = fingerprint
             
-            # 添加用户消息
-            history.append({"role": "user", "content": player_message})
+            # 只发送最近的若干条历史；用户消息等请求成功后再写入历史
+            user_message = {"role": "user", "content": player_message}
+            window = self.config_service.get_history_window()
+            recent = islice(history, max(0, len(history) - window), None)
+            request_messages = [system_message, *recent, user_message]
             
             # 调用AI API
             ai_config = self.config_service.get_ai_config()
-            response = await asyncio.to_thread(
-                self.client.chat.completions.create,
+            response = await client.chat.completions.create(
                 model=ai_config['model'],
-                messages=history,
+                messages=request_messages,
                 max_tokens=200,
-                temperature=0.7,
-                timeout=30
+                temperature=0.7
             )
             
             if not response.choices or not response.choices[0].message.content:
@@ -130,12 +225,10 @@ class AIService:
             # 解析JSON响应
             try:
                 # 清理可能的markdown代码块标记
-                if content.startswith("```json"):
-                    content = content[7:]
-                if content.endswith("```"):
-                    content = content[:-3]
+                match = _FENCE_RE.match(content)
+                payload = match.group(1) if match else content
                 
-                ai_response = json.loads(content)
+                ai_response = orjson.loads(payload) if orjson else json.loads(payload)
                 
                 # 验证响应格式
                 if "msg" not in ai_response:
@@ -145,29 +238,28 @@ class AIService:
                 new_mood = float(ai_response.get("mood", mood))
                 new_mood = max(0.0, min(1.0, new_mood))
                 
-                # 添加AI回复到历史
+                # 添加本轮对话到历史（deque 满时自动丢弃最旧的消息）
+                history.append(user_message)
                 history.append({"role": "assistant", "content": ai_response["msg"]})
                 
-                # 限制历史长度
-                if len(history) > 20:  # 保留系统消息 + 最近9轮对话
-                    history = [history[0]] + history[-19:]
-                
                 return {
                     "msg": ai_response["msg"],
                     "mood": new_mood,
                     "status": "success"
                 }
                 
+            # orjson.JSONDecodeError 同时是 json.JSONDecodeError 和 ValueError 的子类
             except (json.JSONDecodeError, ValueError) as e:
                 # JSON解析失败，尝试提取纯文本回复
                 if self.config_service.is_debug_mode():
                     print(f"JSON 解析失败: {e}, 原始内容: {content}")
                 
-                # 添加纯文本回复到历史
-                history.append({"role": "assistant", "content": content})
+                # 添加本轮对话和纯文本回复到历史
+                history.append(user_message)
+                history.append({"role": "assistant", "content": payload})
                 
                 return {
-                    "msg": content,
+                    "msg": payload,
                     "mood": mood,  # 保持原心情值
                     "status": "success_text"
                 }
@@ -211,9 +303,10 @@ class AIService:
     def get_session_info(self, session_id: str = "default") -> Dict[str, Any]:
         """获取会话信息"""
         history = self._get_session_history(session_id)
+        has_system_prompt = session_id in self._system_prompts
         return {
             "session_id": session_id,
-            "message_count": len(history),
-            "has_system_prompt": len(history) > 0 and history[0].get("role") == "system"
+            "message_count": len(history) + has_system_prompt,
+            "has_system_prompt": has_system_prompt
         }
 
@@ -3,7 +3,9 @@
 管理游戏配置信息
 """
 import os
-from typing import Dict, Any
+import functools
+from types import MappingProxyType
+from typing import Dict, Any, Mapping
 
 # 尝试导入配置文件
 try:
@@ -11,68 +13,95 @@ try:
 except ImportError:
     config = None
 
+_MISSING = object()
+
+
+@functools.lru_cache(maxsize=1)
+def _build_config() -> Dict[str, Any]:
+    """加载配置（进程内只解析一次）"""
+    # 默认配置
+    default_config = {
+        'game_title': 'AI Chat Game',
+        'game_version': '2.0.0-webcli',
+        'max_response_length': 500,
+        'history_window': 8,  # 每次请求携带的历史消息条数
+        'debug_mode': False,
+        'ai_provider': 'kimi',
+        'api_key': '',
+        'model': 'kimi-k2-0711-preview',
+        'api_base_url': 'https://api.moonshot.cn/v1',
+        'default_mood': 0.5,
+        'session_timeout': 3600,  # 1 小时
+        'server_host': '0.0.0.0',
+        'server_port': 8080,
+    }
+    
+    # 从 config.py 加载配置：按默认配置项的大写名称直接取值，不再反射遍历整个模块
+    if config:
+        for config_key in list(default_config):
+            attr_value = getattr(config, config_key.upper(), _MISSING)
+            if attr_value is not _MISSING:
+                default_config[config_key] = attr_value
+    
+    # 从环境变量覆盖配置
+    env_mappings = {
+        'GAME_TITLE': 'game_title',
+        'DEBUG_MODE': 'debug_mode',
+        'AI_PROVIDER': 'ai_provider',
+        'API_KEY': 'api_key',
+        'MODEL': 'model',
+        'API_BASE_URL': 'api_base_url',
+        'SERVER_HOST': 'server_host',
+        'SERVER_PORT': 'server_port',
+    }
+    
+    for env_key, config_key in env_mappings.items():
+        env_value = os.getenv(env_key)
+        if env_value:
+            # 处理布尔值
+            if config_key == 'debug_mode':
+                default_config[config_key] = env_value.lower() in ('true', '1', 'yes')
+            # 处理整数值
+            elif config_key == 'server_port':
+                try:
+                    default_config[config_key] = int(env_value)
+                except ValueError:
+                    pass
+            else:
+                default_config[config_key] = env_value
+    
+    return default_config
+
+
+# 会被 ConfigService 预先计算的配置项，set() 修改它们时需要刷新快照
+_SNAPSHOT_KEYS = frozenset({
+    'ai_provider', 'api_key', 'model', 'api_base_url',
+    'debug_mode', 'max_response_length',
+})
+
 
 class ConfigService:
     """配置服务类"""
     
     def __init__(self):
         self.config = self._load_config()
+        self._refresh_snapshot()
     
     def _load_config(self) -> Dict[str, Any]:
         """加载配置"""
-        # 默认配置
-        default_config = {
-            'game_title': 'AI Chat Game',
-            'game_version': '2.0.0-webcli',
-            'max_response_length': 500,
-            'debug_mode': False,
-            'ai_provider': 'kimi',
-            'api_key': '',
-            'model': 'kimi-k2-0711-preview',
-            'api_base_url': 'https://api.moonshot.cn/v1',
-            'default_mood': 0.5,
-            'session_timeout': 3600,  # 1 小时
-            'server_host': '0.0.0.0',
-            'server_port': 8080,
-        }
-        
-        # 从 config.py 加载配置
-        if config:
-            for attr_name in dir(config):
-                if not attr_name.startswith('_'):
-                    attr_value = getattr(config, attr_name)
-                    # 转换配置名称格式
-                    config_key = attr_name.lower()
-                    default_config[config_key] = attr_value
-        
-        # 从环境变量覆盖配置
-        env_mappings = {
-            'GAME_TITLE': 'game_title',
-            'DEBUG_MODE': 'debug_mode',
-            'AI_PROVIDER': 'ai_provider',
-            'API_KEY': 'api_key',
-            'MODEL': 'model',
-            'API_BASE_URL': 'api_base_url',
-            'SERVER_HOST': 'server_host',
-            'SERVER_PORT': 'server_port',
-        }
-        
-        for env_key, config_key in env_mappings.items():
-            env_value = os.getenv(env_key)
-            if env_value:
-                # 处理布尔值
-                if config_key == 'debug_mode':
-                    default_config[config_key] = env_value.lower() in ('true', '1', 'yes')
-                # 处理整数值
-                elif config_key == 'server_port':
-                    try:
-                        default_config[config_key] = int(env_value)
-                    except ValueError:
-                        pass
-                else:
-                    default_config[config_key] = env_value
-        
-        return default_config
+        # 复制一份缓存结果，保证 set() 只影响当前实例
+        return dict(_build_config())
+    
+    def _refresh_snapshot(self):
+        """预先计算每次 AI 请求都会读取的配置值"""
+        self._ai_config = MappingProxyType({
+            'provider': self.get('ai_provider'),
+            'api_key': self.get('api_key'),
+            'model': self.get('model'),
+            'base_url': self.get('api_base_url'),
+        })
+        self._debug = bool(self.get('debug_mode', False))
+        self._max_len = self.get('max_response_length', 500)
     
     def get(self, key: str, default=None):
         """获取配置值"""
@@ -81,27 +110,28 @@ class ConfigService:
     def set(self, key: str, value: Any):
         """设置配置值"""
         self.config[key] = value
+        if key in _SNAPSHOT_KEYS:
+            self._refresh_snapshot()
     
     def get_game_title(self) -> str:
         """获取游戏标题"""
         return self.get('game_title')
     
-    def get_ai_config(self) -> Dict[str, Any]:
-        """获取 AI 配置"""
-        return {
-            'provider': self.get('ai_provider'),
-            'api_key': self.get('api_key'),
-            'model': self.get('model'),
-            'base_url': self.get('api_base_url'),
-        }
+    def get_ai_config(self) -> Mapping[str, Any]:
+        """获取 AI 配置（只读）"""
+        return self._ai_config
     
     def is_debug_mode(self) -> bool:
         """是否为调试模式"""
-        return self.get('debug_mode', False)
+        return self._debug
     
     def get_max_response_length(self) -> int:
         """获取最大回复长度"""
-        return self.get('max_response_length', 500)
+        return self._max_len
+    
+    def get_history_window(self) -> int:
+        """获取每次 AI 请求携带的历史消息条数"""
+        return self.get('history_window', 8)
     
     def get_default_mood(self) -> float:
         """获取默认心情值"""
@@ -3,24 +3,187 @@
 整合各个服务模块，处理游戏逻辑
 """
 import asyncio
-from typing import Dict, Any, List, Tuple
+import concurrent.futures
+import threading
+from typing import Callable, Dict, Any, List
 from service_config import ConfigService
 from service_world import WorldService
 from service_character import CharacterService
-from service_ai import AIService
+from service_ai import AIService, MAX_RETRIES, REQUEST_TIMEOUT, close_openai_clients
+
+# 可选依赖：uvloop 的事件循环调度开销更低，未安装时使用标准库 asyncio
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# 帮助信息
+_HELP_MSG = """Available Commands:
+
+Exploration Commands:
+  look / 看             - View current location
+  where / 位置          - Show current location name
+  go <direction> / 走 <方向>   - Move (north/south/east/west or 北/南/东/西)
+  
+Character Commands:
+  characters / 角色     - List characters in current location
+  talk <character> <message> / 说 <角色> <消息> - Chat with AI characters
+  fight <character> / 战斗 <角色> - Fight with a character
+  
+System Commands:
+  status / 状态         - Show game status
+  help / 帮助           - Show this help information
+  clear / 清空          - Clear screen
+
+Examples:
+  看                   - Look around
+  北 or go north       - Move north
+  说 elder 你好        - Greet the elder"""
+
+# 等待一次 AI 对话的最长时间：每次尝试的超时乘以尝试次数，再留出重试退避的余量
+_TALK_TIMEOUT = REQUEST_TIMEOUT * (MAX_RETRIES + 1) + 10
+
+# 每个游戏状态中历史记录条目对象池的容量上限
+_HISTORY_POOL_SIZE = 64
 
 
 class GameService:
     """游戏主服务类"""
     
+    # AI 服务不可用时的备用回复模板
+    _MOCK_TEMPLATES = {
+        "elder": "年轻的冒险者，我听到你说'{msg}'。村庄的智慧告诉我们，每一次交流都是学习的机会。",
+        "shopkeeper": "欢迎光临！关于'{msg}'，我想我可能有些有用的东西给你。",
+        "traveler": "有趣...'{msg}'让我想起了远方的一些传说...",
+        "villager": "哦，'{msg}'啊，这让我想起了村里的一些事情。",
+        "fisherman": "嗯...'{msg}'...就像河水一样，话语也有它的流向。"
+    }
+    _MOCK_DEFAULT = "关于'{msg}'，我需要想想..."
+    
     def __init__(self):
         self.config_service = ConfigService()
+        self.reload_config()
         self.world_service = WorldService()
         self.character_service = CharacterService()
         self.ai_service = AIService()
+        # 所有对话复用同一个常驻后台线程中的事件循环（AI 客户端按循环缓存），
+        # 各请求线程通过 run_coroutine_threadsafe 提交协程，可以并发等待
+        self._loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(
+            target=self._loop.run_forever, name="game-ai-loop", daemon=True
+        )
+        self._loop_thread.start()
         
         # 初始化角色位置
         self._sync_character_locations()
+        
+        # 预先生成所有角色的固定提示词片段
+        for character in self.character_service.get_all_characters().values():
+            self.ai_service.prepare_character_prompt(character)
+        
+        # 命令别名 -> 处理函数，统一签名为 (rest, game_state)，rest 为命令词之后的原始文本
+        self._dispatch = self._build_dispatch()
+    
+    def _build_dispatch(self) -> Dict[str, Callable[[str, Dict[str, Any]], str]]:
+        """构建命令分发表"""
+        command_groups = (
+            (('clear', '清空', '清屏'),
+             lambda rest, game_state: self._handle_clear_command(game_state)),
+            (('help', 'h', '帮助', '命令'),
+             lambda rest, game_state: self._get_help_message()),
+            (('look', 'l', '看', '查看', '观察'),
+             lambda rest, game_state: self._handle_look_command()),
+            (('where', '位置', '我在哪'),
+             lambda rest, game_state: self._handle_where_command()),
+            (('characters', 'chars', '角色', '人物', 'npc'),
+             lambda rest, game_state: self._handle_characters_command()),
+            (('go', 'move', '走', '去', '移动'),
+             lambda rest, game_state: self._handle_move_command(rest.lower().split(), game_state)),
+            (('talk', 'say', '说', '聊', '对话', '交谈'), self._handle_talk_command),
+            (('status', 'stat', '状态'),
+             lambda rest, game_state: self._handle_status_command(game_state)),
+        )
+        
+        dispatch = {}
+        for aliases, handler in command_groups:
+            for alias in aliases:
+                dispatch[alias] = handler
+        
+        # 直接输入方向即移动，方向名本身作为参数
+        for direction in ('north', 'n', 'south', 's', 'east', 'e', 'west', 'w',
+                          '北', '南', '东', '西', '上', '下', '左', '右'):
+            dispatch[direction] = (
+                lambda rest, game_state, direction=direction:
+                    self._handle_direction_command(direction, game_state)
+            )
+        
+        return dispatch
+    
+    def reload_config(self):
+        """重新读取游戏服务缓存的配置值（运行时修改配置后调用）"""
+        self._debug = self.config_service.is_debug_mode()
+        self._title = self.config_service.get_game_title()
+        self._version = self.config_service.get('game_version')
+        self._welcome_msg = f"""Welcome to {self._title}!
+
+You are a young adventurer who has just arrived in a mysterious realm.
+Explore this world and chat with AI-driven characters!
+
+Tip: Type 'help' to see available commands
+Tip: Type 'clear' to clear the screen
+
+---"""
+    
+    def close(self):
+        """停止并释放游戏服务持有的事件循环"""
+        if self._loop.is_closed():
+            return
+        # 先在循环内取消进行中的对话并关闭 AI 客户端连接池
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown_loop(), self._loop).result(timeout=5)
+        except Exception as e:
+            print(f"关闭 AI 客户端失败: {e!r}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5)
+        if self._loop_thread.is_alive():
+            # 循环卡住时不再等待（线程为守护线程），也不能关闭仍在运行的循环
+            print("事件循环未能及时停止，放弃关闭")
+            return
+        self._loop.close()
+    
+    async def _shutdown_loop(self):
+        """取消事件循环中的其他任务，并关闭该循环创建的 AI 客户端"""
+        current = asyncio.current_task()
+        pending = [task for task in asyncio.all_tasks() if task is not current]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await close_openai_clients()
+    
+    def new_history_entry(self, game_state: Dict[str, Any], entry_type: str, content: str) -> Dict[str, Any]:
+        """创建历史记录条目，优先复用该游戏状态回收的条目"""
+        # 对象池只在首次清空后才创建，之前直接新建条目
+        pool = game_state.get('_history_pool')
+        try:
+            entry = pool.pop() if pool else {}
+        except IndexError:
+            # 同一会话的并发请求可能抢走了最后一个条目
+            entry = {}
+        # 只覆盖字段、不清空，仍在读取旧历史的请求不会遇到缺失的键
+        entry['type'] = entry_type
+        entry['content'] = content
+        return entry
+    
+    def clear_history(self, game_state: Dict[str, Any]):
+        """清空游戏历史，并把条目回收到该游戏状态自己的对象池"""
+        history = game_state.get('history', [])
+        pool = game_state.setdefault('_history_pool', [])
+        room = _HISTORY_POOL_SIZE - len(pool)
+        if room > 0:
+            pool.extend(history[:room])
+        # 换成新列表而不是原地清空，正在遍历旧列表的请求不会中途出错；
+        # 但回收的正是旧列表里的条目，复用后这类请求可能显示到新的内容
+        game_state['history'] = []
     
     def _sync_character_locations(self):
         """同步角色位置到世界服务"""
@@ -43,100 +206,49 @@ class GameService:
         
         # 添加欢迎信息
         welcome_msg = self._get_welcome_message()
-        game_state['history'].append({
-            'type': 'system',
-            'content': welcome_msg
-        })
+        game_state['history'].append(self.new_history_entry(game_state, 'system', welcome_msg))
         
         # 添加初始位置描述
         location_desc = self.world_service.get_location_description()
-        game_state['history'].append({
-            'type': 'system',
-            'content': location_desc
-        })
+        game_state['history'].append(self.new_history_entry(game_state, 'system', location_desc))
         
         return game_state
     
     def _get_welcome_message(self) -> str:
         """获取欢迎信息"""
-        return f"""Welcome to {self.config_service.get_game_title()}!
-
-You are a young adventurer who has just arrived in a mysterious realm.
-Explore this world and chat with AI-driven characters!
-
-Tip: Type 'help' to see available commands
-Tip: Type 'clear' to clear the screen
-
----"""
+        return self._welcome_msg
     
     def process_command(self, command: str, game_state: Dict[str, Any]) -> str:
         """处理玩家命令"""
-        command = command.strip().lower()
+        # 只切出命令词并转小写，其余文本原样交给处理函数（对话内容保留空格和大小写）
+        parts = command.split(None, 1)
 
-        if not command:
+        if not parts:
             return "请输入一个命令。"
 
-        parts = command.split()
-        action = parts[0]
-        args = parts[1:] if len(parts) > 1 else []
+        action = parts[0].lower()
+        rest = parts[1] if len(parts) > 1 else ""
 
+        handler = self._dispatch.get(action)
+        if handler is None:
+            return f"未知命令: {action}\n输入 'help' 查看可用命令。"
+        
         try:
-            match action:
-                case 'clear' | '清空' | '清屏':
-                    return self._handle_clear_command(game_state)
-                case 'help' | 'h' | '帮助' | '命令':
-                    return self._get_help_message()
-                case 'look' | 'l' | '看' | '查看' | '观察':
-                    return self._handle_look_command()
-                case 'where' | '位置' | '我在哪':
-                    return self._handle_where_command()
-                case 'characters' | 'chars' | '角色' | '人物' | 'npc':
-                    return self._handle_characters_command()
-                case 'go' | 'move' | '走' | '去' | '移动':
-                    return self._handle_move_command(args, game_state)
-                case ('north' | 'n' | 'south' | 's' | 'east' | 'e' | 'west' | 'w'
-                      | '北' | '南' | '东' | '西' | '上' | '下' | '左' | '右'):
-                    return self._handle_direction_command(action, game_state)
-                case 'talk' | 'say' | '说' | '聊' | '对话' | '交谈':
-                    return self._handle_talk_command(args, game_state)
-                case 'status' | 'stat' | '状态':
-                    return self._handle_status_command(game_state)
-                case _:
-                    return f"未知命令: {action}\n输入 'help' 查看可用命令。"
+            return handler(rest, game_state)
         except Exception as e:
-            if self.config_service.is_debug_mode():
+            if self._debug:
                 return f"处理命令时出错: {str(e)}"
             else:
                 return "出现了一些问题，请重试。"
     
     def _handle_clear_command(self, game_state: Dict[str, Any]) -> str:
         """处理清空命令"""
-        game_state['history'] = []
+        self.clear_history(game_state)
         return "屏幕已清空。"
     
     def _get_help_message(self) -> str:
         """获取帮助信息"""
-        return """Available Commands:
-
-Exploration Commands:
-  look / 看             - View current location
-  where / 位置          - Show current location name
-  go <direction> / 走 <方向>   - Move (north/south/east/west or 北/南/东/西)
-  
-Character Commands:
-  characters / 角色     - List characters in current location
-  talk <character> <message> / 说 <角色> <消息> - Chat with AI characters
-  fight <character> / 战斗 <角色> - Fight with a character
-  
-System Commands:
-  status / 状态         - Show game status
-  help / 帮助           - Show this help information
-  clear / 清空          - Clear screen
-
-Examples:
-  看                   - Look around
-  北 or go north       - Move north
-  说 elder 你好        - Greet the elder"""
+        return _HELP_MSG
     
     def _handle_look_command(self) -> str:
         """处理查看命令"""
@@ -155,25 +267,22 @@ Examples:
         if not characters:
             return "There are no other people here."
         
-        char_list = []
-        for char_id, character in characters.items():
-            char_list.append(f"  • {character.name} (ID: {char_id}) - {character.get_description()}")
+        char_list = "\n".join(
+            f"  • {character.name} (ID: {char_id}) - {character.get_description()}"
+            for char_id, character in characters.items()
+        )
         
-        return "Characters here:\n" + "\n".join(char_list) + "\n\nTip: Use 'talk <character_id> <message>' to chat with them"
+        return "Characters here:\n" + char_list + "\n\nTip: Use 'talk <character_id> <message>' to chat with them"
     
     def _handle_move_command(self, args: List[str], game_state: Dict[str, Any]) -> str:
         """处理移动命令"""
         if not args:
-            directions = self.world_service.get_available_directions()
-            direction_names = {
-                "north": "北方", "south": "南方",
-                "east": "东方", "west": "西方",
-                "up": "上方", "down": "下方"
-            }
-            available = [direction_names.get(d, d) for d in directions]
-            return f"去哪里？可用方向: {', '.join(available)}"
+            return f"去哪里？可用方向: {self.world_service.get_available_directions_text()}"
         
-        direction = args[0]
+        return self._handle_direction_command(args[0], game_state)
+    
+    def _handle_direction_command(self, direction: str, game_state: Dict[str, Any]) -> str:
+        """处理直接方向命令"""
         success, message = self.world_service.move_to(direction)
         
         if success:
@@ -185,39 +294,50 @@ Examples:
         else:
             return message
     
-    def _handle_direction_command(self, direction: str, game_state: Dict[str, Any]) -> str:
-        """处理直接方向命令"""
-        return self._handle_move_command([direction], game_state)
-    
-    def _handle_talk_command(self, args: List[str], game_state: Dict[str, Any]) -> str:
+    def _handle_talk_command(self, rest: str, game_state: Dict[str, Any]) -> str:
         """处理对话命令"""
-        if len(args) < 1:
+        args = rest.split(None, 1)
+        if not args:
             return "和谁说话？使用: talk <角色ID> <消息>\n或者: 说 <角色ID> <消息>"
         
-        character_id = args[0]
-        message = " ".join(args[1:]) if len(args) > 1 else "你好"
+        character_id = args[0].lower()
+        message = args[1].rstrip() if len(args) > 1 else "你好"
         
         # 检查角色是否存在
         character = self.character_service.get_character(character_id)
         if not character:
             return f"没有找到角色 '{character_id}'。\n输入 'characters' 查看当前位置的角色。"
         
-        # 检查角色是否在当前位置
-        current_location = self.world_service.current_location
-        if character.location != current_location:
+        # 检查角色是否在当前位置（与 characters 命令同样以角色服务记录的位置为准）
+        if character.location != self.world_service.current_location:
             return f"{character.name} 不在这里。"
         
+        # 服务关闭后事件循环不可用，在创建协程前直接返回，避免协程未被等待
+        if self._loop.is_closed():
+            return "游戏服务已关闭，无法与角色对话。"
+        
         # 调用AI服务获取回复
         try:
-            # 使用asyncio.run来运行异步函数
-            ai_response = asyncio.run(self.ai_service.get_character_response(
-                character_name=character.name,
-                character_personality=character.personality,
+            # 提交到常驻事件循环中运行，并等待结果
+            coro = self.ai_service.get_character_response(
+                character=character,
                 player_message=message,
                 current_location=self.world_service.get_current_location().name,
                 mood=character.mood,
                 session_id=f"char_{character_id}"
-            ))
+            )
+            try:
+                future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+            except RuntimeError:
+                # 检查之后循环仍可能被并发关闭
+                coro.close()
+                raise
+            try:
+                ai_response = future.result(timeout=_TALK_TIMEOUT)
+            except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError) as e:
+                # CancelledError 不是 Exception 的子类，转换后交给下面的备用回复处理
+                future.cancel()
+                raise RuntimeError("AI 服务响应超时或已取消") from e
             
             response_text = ai_response.get("msg", "...")
             new_mood = ai_response.get("mood", character.mood)
@@ -230,14 +350,14 @@ Examples:
             
             # 添加状态信息（调试模式下）
             status_info = ""
-            if self.config_service.is_debug_mode():
+            if self._debug:
                 status = ai_response.get("status", "unknown")
                 status_info = f"\n[调试: {status}, 心情: {character.mood:.2f}]"
             
             return f"You said to {character.name}: \"{message}\"\n\n{character.name}: \"{response_text}\"{status_info}"
             
         except Exception as e:
-            if self.config_service.is_debug_mode():
+            if self._debug:
                 return f"AI服务错误: {str(e)}\n使用备用回复..."
             
             # 使用备用回复
@@ -247,24 +367,17 @@ Examples:
     
     def _get_mock_ai_response(self, character, message: str) -> str:
         """获取模拟AI回复（临时实现）"""
-        responses = {
-            "elder": f"年轻的冒险者，我听到你说'{message}'。村庄的智慧告诉我们，每一次交流都是学习的机会。",
-            "shopkeeper": f"欢迎光临！关于'{message}'，我想我可能有些有用的东西给你。",
-            "traveler": f"有趣...'{message}'让我想起了远方的一些传说...",
-            "villager": f"哦，'{message}'啊，这让我想起了村里的一些事情。",
-            "fisherman": f"嗯...'{message}'...就像河水一样，话语也有它的流向。"
-        }
-        
-        return responses.get(character.character_id, f"关于'{message}'，我需要想想...")
+        template = self._MOCK_TEMPLATES.get(character.character_id, self._MOCK_DEFAULT)
+        return template.format(msg=message)
     
     def _handle_status_command(self, game_state: Dict[str, Any]) -> str:
         """处理状态命令"""
         location = self.world_service.get_current_location()
-        char_count = len(self.world_service.get_characters_in_current_location())
+        char_count = len(location.characters)
         
         return f"""Game Status:
 Current Location: {location.name}
 Characters in Location: {char_count}
-Game Version: {self.config_service.get('game_version')}
+Game Version: {self._version}
 History Count: {len(game_state.get('history', []))}"""
 
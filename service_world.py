@@ -2,45 +2,57 @@
 世界管理服务模块
 管理游戏世界、位置和移动逻辑
 """
-from typing import Dict, Any, List, Tuple, Optional
+from types import MappingProxyType
+from typing import Dict, Any, Iterator, List, Set, Tuple, Optional
+
+# 方向 -> 中文名称
+DIRECTION_NAMES = MappingProxyType({
+    "north": "北方", "south": "南方",
+    "east": "东方", "west": "西方",
+    "up": "上方", "down": "下方"
+})
+
+# 所有可接受的方向写法 -> 标准方向（标准方向本身也在其中）
+DIRECTION_MAP = MappingProxyType({
+    "north": "north", "south": "south", "east": "east", "west": "west",
+    "up": "up", "down": "down",
+    "n": "north", "s": "south", "e": "east", "w": "west",
+    "北": "north", "南": "south", "东": "east", "西": "west",
+    "上": "up", "下": "down", "北方": "north", "南方": "south",
+    "东方": "east", "西方": "west", "上方": "up", "下方": "down"
+})
 
 
 class Location:
     """位置类"""
     
+    __slots__ = ('name', 'description', 'exits', 'characters',
+                 '_static_desc', '_exits_desc', '_available_dirs_zh_csv')
+    
     def __init__(self, name: str, description: str, exits: Dict[str, str] = None):
         self.name = name
         self.description = description
         self.exits = exits or {}
-        self.characters = []  # 该位置的角色列表
+        self.characters: Set[str] = set()  # 该位置的角色 ID 集合
+        # 名称、描述和出口在初始化后不再变化，预先生成出口描述和描述的固定部分
+        self._available_dirs_zh_csv = ", ".join(DIRECTION_NAMES.get(d, d) for d in self.exits)
+        self._exits_desc = (
+            "这里没有明显的出路。" if not self.exits
+            else f"可以前往: {self._available_dirs_zh_csv}"
+        )
+        self._static_desc = f"📍 {name}\n\n{description}\n\n{self._exits_desc}"
     
     def add_character(self, character_id: str):
         """添加角色到该位置"""
-        if character_id not in self.characters:
-            self.characters.append(character_id)
+        self.characters.add(character_id)
     
     def remove_character(self, character_id: str):
         """从该位置移除角色"""
-        if character_id in self.characters:
-            self.characters.remove(character_id)
+        self.characters.discard(character_id)
     
     def get_exits_description(self) -> str:
         """获取出口描述"""
-        if not self.exits:
-            return "这里没有明显的出路。"
-        
-        exit_list = []
-        direction_names = {
-            "north": "北方", "south": "南方",
-            "east": "东方", "west": "西方",
-            "up": "上方", "down": "下方"
-        }
-        
-        for direction in self.exits.keys():
-            chinese_dir = direction_names.get(direction, direction)
-            exit_list.append(chinese_dir)
-        
-        return f"可以前往: {', '.join(exit_list)}"
+        return self._exits_desc
 
 
 class WorldService:
@@ -49,6 +61,7 @@ class WorldService:
     def __init__(self):
         self.locations = {}
         self.current_location = "village_center"
+        self._char_location: Dict[str, str] = {}  # 角色 ID -> 所在位置 ID
         self._initialize_world()
     
     def _initialize_world(self):
@@ -117,38 +130,27 @@ class WorldService:
     
     def get_location_description(self) -> str:
         """获取当前位置的完整描述"""
-        location = self.get_current_location()
+        location = self.locations.get(self.current_location)
         if not location:
             return "你似乎迷失在了未知的地方..."
         
-        description = f"📍 {location.name}\n\n{location.description}\n\n{location.get_exits_description()}"
-        
         # 添加角色信息
         if location.characters:
-            description += f"\n\n👥 这里有: {', '.join(location.characters)}"
+            return f"{location._static_desc}\n\n👥 这里有: {', '.join(sorted(location.characters))}"
         
-        return description
+        return location._static_desc
     
     def move_to(self, direction: str) -> Tuple[bool, str]:
         """移动到指定方向"""
-        current_loc = self.get_current_location()
+        current_loc = self.locations.get(self.current_location)
         if not current_loc:
             return False, "当前位置未知，无法移动。"
         
-        # 方向映射
-        direction_map = {
-            "北": "north", "南": "south", "东": "east", "西": "west",
-            "上": "up", "下": "down", "北方": "north", "南方": "south",
-            "东方": "east", "西方": "west", "上方": "up", "下方": "down"
-        }
-        
-        # 标准化方向
-        normalized_direction = direction_map.get(direction, direction)
-        
-        if normalized_direction not in current_loc.exits:
+        # 标准化方向，一次查表同时完成校验
+        target_location = current_loc.exits.get(DIRECTION_MAP.get(direction))
+        if target_location is None:
             return False, f"无法向{direction}移动，那里没有路。"
         
-        target_location = current_loc.exits[normalized_direction]
         if target_location not in self.locations:
             return False, f"目标位置 {target_location} 不存在。"
         
@@ -157,18 +159,30 @@ class WorldService:
     
     def get_available_directions(self) -> List[str]:
         """获取可用的移动方向"""
-        current_loc = self.get_current_location()
+        current_loc = self.locations.get(self.current_location)
         if not current_loc:
             return []
         return list(current_loc.exits.keys())
     
+    def get_available_directions_text(self) -> str:
+        """获取可用移动方向的中文名称（逗号分隔）"""
+        current_loc = self.locations.get(self.current_location)
+        if not current_loc:
+            return ""
+        return current_loc._available_dirs_zh_csv
+    
     def add_character_to_location(self, character_id: str, location_id: str = None):
         """将角色添加到指定位置"""
         if location_id is None:
             location_id = self.current_location
         
         if location_id in self.locations:
+            # 角色只能出现在一个位置，先从旧位置移除
+            old_location_id = self._char_location.get(character_id)
+            if old_location_id is not None and old_location_id != location_id:
+                self.locations[old_location_id].remove_character(character_id)
             self.locations[location_id].add_character(character_id)
+            self._char_location[character_id] = location_id
     
     def remove_character_from_location(self, character_id: str, location_id: str = None):
         """从指定位置移除角色"""
@@ -177,13 +191,26 @@ class WorldService:
         
         if location_id in self.locations:
             self.locations[location_id].remove_character(character_id)
+            if self._char_location.get(character_id) == location_id:
+                del self._char_location[character_id]
+    
+    def get_character_location(self, character_id: str) -> Optional[str]:
+        """获取角色所在的位置 ID"""
+        return self._char_location.get(character_id)
+    
+    def iter_characters_in_current_location(self) -> Iterator[str]:
+        """遍历当前位置的所有角色（不复制，遍历期间不要增删角色）"""
+        current_loc = self.locations.get(self.current_location)
+        if not current_loc:
+            return iter(())
+        return iter(current_loc.characters)
     
     def get_characters_in_current_location(self) -> List[str]:
-        """获取当前位置的所有角色"""
-        current_loc = self.get_current_location()
+        """获取当前位置的所有角色（排序后的副本）"""
+        current_loc = self.locations.get(self.current_location)
         if not current_loc:
             return []
-        return current_loc.characters.copy()
+        return sorted(current_loc.characters)
     
     def reset_to_start(self):
         """重置到起始位置"""
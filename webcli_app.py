@@ -43,14 +43,12 @@ class WebCLIApp:
         # 处理命令
         if command.strip():
             response = self.game_service.process_command(command.strip(), game_state)
-            game_state['history'].append({
-                'type': 'command',
-                'content': f"> {command}"
-            })
-            game_state['history'].append({
-                'type': 'response',
-                'content': response
-            })
+            game_state['history'].append(
+                self.game_service.new_history_entry(game_state, 'command', f"> {command}")
+            )
+            game_state['history'].append(
+                self.game_service.new_history_entry(game_state, 'response', response)
+            )
         
         # 构建历史记录 HTML
         history_html = ""
@@ -228,7 +226,7 @@ class WebCLIApp:
     def clear(self):
         """清空游戏历史"""
         game_state = self._get_game_state()
-        game_state['history'] = []
+        self.game_service.clear_history(game_state)
         # 重定向回主页
         raise cherrypy.HTTPRedirect('/')
 
@@ -260,8 +258,10 @@ def main():
     print("Press Ctrl+C to stop server")
     print("=" * 60)
     
-    # 启动应用
-    cherrypy.quickstart(WebCLIApp(), '/', config)
+    # 启动应用，服务器停止时释放游戏服务的事件循环
+    app = WebCLIApp()
+    cherrypy.engine.subscribe('stop', app.game_service.close)
+    cherrypy.quickstart(app, '/', config)
 
 
 if __name__ == '__main__':